@@ -0,0 +1,314 @@
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel, field_validator
+
+from graph_engine import (
+    NodeWorkCache,
+    OperationsGraph,
+    check_memory_budget,
+    create_graph,
+    make_time_index,
+    node_cache_keys,
+    process_dynamic_graph,
+    propagate_flows,
+    simulate_and_fill,
+    summarize_results,
+)
+
+class Scenario(BaseModel):
+    id: Optional[str] = None # defaults to the scenario's position in the batch
+    graph: OperationsGraph
+    readings: int = 720
+    compact: bool = False
+    seed: Optional[int] = None
+
+def scenario_id_at(scenario: Scenario, position: int) -> str:
+    return scenario.id if scenario.id is not None else str(position)
+
+class BatchRequest(BaseModel):
+    scenarios: List[Scenario]
+    seed: Optional[int] = None # used by scenarios that don't set their own
+
+    @field_validator('scenarios')
+    @classmethod
+    def ids_are_unique(cls, scenarios: List[Scenario]) -> List[Scenario]:
+        # Entries stream back in completion order, so ids are the only way to match them up
+        seen = set()
+        for i, scenario in enumerate(scenarios):
+            scenario_id = scenario_id_at(scenario, i)
+            if scenario_id in seen:
+                raise ValueError(f"duplicate scenario id {scenario_id!r} (ids default to the scenario's position)")
+            seen.add(scenario_id)
+        return scenarios
+
+def topology_key(scenario: Scenario) -> tuple:
+    """Scenarios with equal keys can have their flows propagated in one stacked pass."""
+    graph = scenario.graph
+    return (
+        scenario.compact,
+        tuple((node.id, node.type) for node in graph.nodes),
+        tuple((edge.source, edge.target, edge.weight) for edge in graph.edges),
+    )
+
+def run_topology_group(scenarios: List[Scenario], cache: Optional[NodeWorkCache] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Runs scenarios that share a topology. Each scenario is simulated and
+    gap-filled on its own (through the shared cache), then every node's data
+    is concatenated along the time axis so flows for the whole group are
+    propagated at once. Results are split back and yielded per scenario, in
+    order, as soon as each is summarized.
+    """
+    compact = scenarios[0].compact
+    dtype = np.float32 if compact else np.float64
+
+    filled, audits = [], []
+    for scenario in scenarios:
+        filled_data_dict, audit_logs = simulate_and_fill(
+            scenario.graph, scenario.readings, compact, seed=scenario.seed, cache=cache
+        )
+        filled.append(filled_data_dict)
+        audits.append(audit_logs)
+
+    offsets = np.cumsum([0] + [scenario.readings for scenario in scenarios])
+    stacked = {
+        node_id: pd.concat([f[node_id].reset_index(drop=True) for f in filled], ignore_index=True)
+        for node_id in filled[0]
+    }
+    nodes_order, node_flows, captured_flows, stored_flows = propagate_flows(
+        create_graph(scenarios[0].graph), stacked, pd.RangeIndex(offsets[-1]), dtype
+    )
+    del stacked
+
+    for i, scenario in enumerate(scenarios):
+        time_index = make_time_index(scenario.readings, compact)
+        start, end = offsets[i], offsets[i + 1]
+
+        def window(series: pd.Series) -> pd.Series:
+            return pd.Series(series.to_numpy()[start:end], index=time_index)
+
+        yield summarize_results(
+            scenario.graph,
+            create_graph(scenario.graph), # names and metadata may differ within a topology
+            nodes_order,
+            {node_id: window(flow) for node_id, flow in node_flows.items()},
+            {node_id: window(flow) for node_id, flow in captured_flows.items()},
+            {node_id: window(flow) for node_id, flow in stored_flows.items()},
+            filled[i],
+            audits[i],
+            scenario.readings,
+            compact,
+        )
+        filled[i] = audits[i] = None # only the cache keeps this scenario's frames now
+
+def _success(scenario: Scenario, result: Dict[str, Any]) -> Dict[str, Any]:
+    return {"id": scenario.id, "status": "success", "data": result}
+
+def _error(scenario: Scenario, error: Exception) -> Dict[str, Any]:
+    return {"id": scenario.id, "status": "error", "detail": str(error)}
+
+def split_group(scenarios: List[Scenario], memory_budget_bytes: Optional[int]) -> Tuple[List[Dict[str, Any]], List[Tuple[List[Scenario], int]]]:
+    """
+    Splits a topology group into stacked runs whose summed memory estimates
+    fit the budget. Returns (error entries for scenarios that don't fit on
+    their own, [(scenarios, estimated bytes)]).
+    """
+    errors, runs = [], []
+    run, run_bytes = [], 0
+    for scenario in scenarios:
+        try:
+            estimate = check_memory_budget(scenario.graph, scenario.readings, scenario.compact, memory_budget_bytes) or 0
+        except Exception as e:
+            errors.append(_error(scenario, e))
+            continue
+        if run and memory_budget_bytes is not None and run_bytes + estimate > memory_budget_bytes:
+            runs.append((run, run_bytes))
+            run, run_bytes = [], 0
+        run.append(scenario)
+        run_bytes += estimate
+    if run:
+        runs.append((run, run_bytes))
+    return errors, runs
+
+class MemoryGate:
+    """
+    Admits concurrent runs while their estimates plus the cache contents fit
+    the budget, and caps the cache at whatever the admitted runs leave free.
+    When nothing is running and the cache alone crowds out the next run,
+    cached entries are evicted rather than exceeding the budget.
+    """
+    def __init__(self, memory_budget_bytes: Optional[int], cache: NodeWorkCache):
+        self._budget = memory_budget_bytes
+        self._cache = cache
+        self._cond = threading.Condition()
+        self._reserved = 0
+        self._running = 0
+        self._closed = False
+        cache.set_capacity(memory_budget_bytes)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _fits(self, nbytes: int) -> bool:
+        if self._budget is None or self._running == 0:
+            return True
+        return self._reserved + nbytes + self._cache.nbytes <= self._budget
+
+    def acquire(self, nbytes: int) -> bool:
+        """Blocks until the run fits; False if the gate was closed meanwhile."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._closed or self._fits(nbytes))
+            if self._closed:
+                return False
+            if self._budget is not None:
+                self._cache.shrink_to(self._budget - self._reserved - nbytes)
+                self._cache.set_capacity(self._budget - self._reserved - nbytes)
+            self._reserved += nbytes
+            self._running += 1
+            return True
+
+    def release(self, nbytes: int):
+        with self._cond:
+            self._reserved -= nbytes
+            self._running -= 1
+            if self._budget is not None:
+                self._cache.set_capacity(self._budget - self._reserved)
+            self._cond.notify_all()
+
+def _run_group(scenarios: List[Scenario], cache: NodeWorkCache) -> Iterator[Dict[str, Any]]:
+    """Yields one entry per scenario, in order."""
+    done = 0
+    if len(scenarios) > 1:
+        try:
+            for scenario, result in zip(scenarios, run_topology_group(scenarios, cache)):
+                yield _success(scenario, result)
+                done += 1
+        except Exception:
+            pass # Run the rest one at a time below so each scenario reports its own error
+
+    for scenario in scenarios[done:]:
+        try:
+            result = process_dynamic_graph(
+                scenario.graph, n_readings=scenario.readings, compact=scenario.compact,
+                seed=scenario.seed, cache=cache,
+            )
+            yield _success(scenario, result)
+        except Exception as e:
+            yield _error(scenario, e)
+
+def run_batch(
+    batch: BatchRequest,
+    memory_budget_bytes: Optional[int] = None,
+    max_workers: Optional[int] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Runs every scenario of a batch, yielding one entry per scenario as soon
+    as it is summarized: {'id', 'status': 'success', 'data'} or
+    {'id', 'status': 'error', 'detail'}.
+
+    Sensor draws (same seed, node and params) and gap-filled node data (also
+    same jurisdiction and metadata) are computed once and shared. Scenarios
+    without a seed draw fresh random data and are never deduplicated.
+    Cached work is dropped as soon as no pending scenario needs it.
+    Scenarios sharing a topology are propagated together, split into runs
+    that fit memory_budget_bytes; runs execute concurrently while their
+    summed estimates plus the shared cache stay within the budget.
+    """
+    scenarios = []
+    for i, scenario in enumerate(batch.scenarios):
+        scenario = scenario.copy()
+        scenario.id = scenario_id_at(scenario, i)
+        if scenario.seed is None:
+            scenario.seed = batch.seed
+        scenarios.append(scenario)
+
+    groups: Dict[tuple, List[Scenario]] = {}
+    for scenario in scenarios:
+        groups.setdefault(topology_key(scenario), []).append(scenario)
+
+    runs = []
+    for group in groups.values():
+        errors, group_runs = split_group(group, memory_budget_bytes)
+        yield from errors
+        runs.extend(group_runs)
+
+    if not runs:
+        return
+
+    cache = NodeWorkCache()
+    for run_scenarios, _ in runs:
+        for scenario in run_scenarios:
+            if scenario.seed is not None:
+                for keys in node_cache_keys(scenario.graph, scenario.readings, scenario.compact, scenario.seed).values():
+                    for key in keys:
+                        cache.retain(key)
+    gate = MemoryGate(memory_budget_bytes, cache)
+    workers = max_workers or min(len(runs), os.cpu_count() or 1)
+    # Bounded, so finished entries wait for the consumer instead of piling up
+    entries = queue.Queue(maxsize=workers)
+    stopped = threading.Event()
+
+    def put(entry) -> bool:
+        while not stopped.is_set():
+            try:
+                entries.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run(run_scenarios: List[Scenario], estimate: int):
+        if not gate.acquire(estimate):
+            return
+        reported = 0
+        try:
+            for entry in _run_group(run_scenarios, cache):
+                if not put(entry):
+                    return
+                reported += 1
+        except Exception as e:
+            for scenario in run_scenarios[reported:]:
+                if not put(_error(scenario, e)):
+                    return
+        finally:
+            # The run's output is part of its estimate, so its memory is only
+            # handed back once the consumer has taken every entry before this.
+            if not put(lambda: gate.release(estimate)):
+                gate.release(estimate)
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for run_scenarios, estimate in runs:
+            pool.submit(run, run_scenarios, estimate)
+        remaining = sum(len(run_scenarios) for run_scenarios, _ in runs)
+        finished = [] # reservations of runs whose last entry the consumer may still hold
+        while remaining:
+            try:
+                entry = entries.get(timeout=0.1)
+            except queue.Empty:
+                # Nothing else is coming until waiting runs are admitted
+                for release in finished:
+                    release()
+                finished = []
+                continue
+            if callable(entry):
+                finished.append(entry)
+                continue
+            remaining -= 1
+            yield entry
+            # The consumer asked for more, so it no longer holds the entries before this one
+            for release in finished:
+                release()
+            finished = []
+    finally:
+        # Stop workers and don't start remaining runs if the consumer stopped reading (e.g. client disconnected)
+        stopped.set()
+        gate.close()
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -1,5 +1,10 @@
 from pydantic import BaseModel
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
+from concurrent.futures import Future
+import base64
+import json
+import threading
+import zlib
 import networkx as nx
 import pandas as pd
 import numpy as np
@@ -35,122 +40,584 @@ def create_graph(ops_graph: OperationsGraph) -> nx.DiGraph:
         G.add_edge(source, target, **edge_payload)
     return G
 
-def simulate_node_data(node_type: str, params: Dict[str, Any], n_readings: int, start_time: datetime) -> pd.DataFrame:
-    # A simple simulation based on node type
-    from sensors import simulate_sensor
-    
-    dfs = []
+def node_sensor_specs(node_type: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Sensors simulated for a node of the given type, as simulate_sensor keyword arguments."""
     if node_type == 'capture':
         base_flow = params.get('base_flow', 150.0)
         efficiency = params.get('efficiency', 88.5)
         dropout = params.get('dropout_rate', 0.05)
-        
-        dfs.append(simulate_sensor(n_readings, base_value=base_flow, noise_std=base_flow*0.05, dropout_rate=dropout, tag_name='FLOW', unit='kg/hr', start_time=start_time))
-        dfs.append(simulate_sensor(n_readings, base_value=efficiency, noise_std=1.0, dropout_rate=dropout/2, tag_name='EFFICIENCY', unit='%', start_time=start_time))
-    
+        return [
+            dict(base_value=base_flow, noise_std=base_flow*0.05, dropout_rate=dropout, tag_name='FLOW', unit='kg/hr'),
+            dict(base_value=efficiency, noise_std=1.0, dropout_rate=dropout/2, tag_name='EFFICIENCY', unit='%'),
+        ]
+
     elif node_type == 'transport':
         leakage = params.get('base_leakage', 1.8)
         dropout = params.get('dropout_rate', 0.02)
-        dfs.append(simulate_sensor(n_readings, base_value=leakage, noise_std=leakage*0.1, dropout_rate=dropout, tag_name='LEAKAGE', unit='kg/hr', start_time=start_time))
+        return [dict(base_value=leakage, noise_std=leakage*0.1, dropout_rate=dropout, tag_name='LEAKAGE', unit='kg/hr')]
 
     elif node_type == 'storage':
         pressure = params.get('base_pressure', 100.0)
         dropout = params.get('dropout_rate', 0.01)
-        dfs.append(simulate_sensor(n_readings, base_value=pressure, noise_std=pressure*0.02, dropout_rate=dropout, tag_name='PRESSURE', unit='bar', start_time=start_time))
+        return [dict(base_value=pressure, noise_std=pressure*0.02, dropout_rate=dropout, tag_name='PRESSURE', unit='bar')]
 
     elif node_type == 'utilization':
         conversion_rate = params.get('conversion_rate', 95.0)
         dropout = params.get('dropout_rate', 0.01)
-        dfs.append(simulate_sensor(n_readings, base_value=conversion_rate, noise_std=1.0, dropout_rate=dropout, tag_name='CONVERSION_RATE', unit='%', start_time=start_time))
+        return [dict(base_value=conversion_rate, noise_std=1.0, dropout_rate=dropout, tag_name='CONVERSION_RATE', unit='%')]
 
-    else:
-        # Generic node
-        val = params.get('value', 100)
-        dfs.append(simulate_sensor(n_readings, base_value=val, noise_std=val*0.05, dropout_rate=0.05, tag_name='GENERIC', unit='unit', start_time=start_time))
+    # Generic node
+    val = params.get('value', 100)
+    return [dict(base_value=val, noise_std=val*0.05, dropout_rate=0.05, tag_name='GENERIC', unit='unit')]
 
+def simulate_node_data(node_type: str, params: Dict[str, Any], n_readings: int, start_time: datetime, rng=None) -> pd.DataFrame:
+    # A simple simulation based on node type
+    from sensors import simulate_sensor
+
+    dfs = [
+        simulate_sensor(n_readings, start_time=start_time, rng=rng, **spec)
+        for spec in node_sensor_specs(node_type, params)
+    ]
     if dfs:
         return pd.concat(dfs, ignore_index=True)
     return pd.DataFrame()
 
-def process_dynamic_graph(ops_graph: OperationsGraph, n_readings: int = 720):
+def simulate_node_arrays(node_type: str, params: Dict[str, Any], n_readings: int, dtype=np.float32, rng=None) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Compact counterpart of simulate_node_data: tag -> (values, packed validity).
+    Values are stored as dtype and validity is bit-packed with np.packbits,
+    one bit per reading; timestamps are implicit (start + i * step).
+    """
+    from sensors import simulate_sensor_values
+
+    arrays = {}
+    for spec in node_sensor_specs(node_type, params):
+        values, valid = simulate_sensor_values(
+            n_readings, spec['base_value'], spec['noise_std'], spec['dropout_rate'], dtype=dtype, rng=rng
+        )
+        arrays[spec['tag_name']] = (values, np.packbits(valid))
+    return arrays
+
+def fill_node_arrays(arrays: Dict[str, Tuple[np.ndarray, np.ndarray]], strategy, metadata: Dict[str, Any], n_readings: int) -> pd.DataFrame:
+    """Gap-fills compact sensor arrays into a wide frame on an implicit RangeIndex time axis."""
+    filled = pd.DataFrame(index=pd.RangeIndex(n_readings))
+    for tag in sorted(arrays):
+        values, packed = arrays[tag]
+        valid = np.unpackbits(packed, count=n_readings).view(bool)
+        values = np.where(valid, values, np.nan).astype(values.dtype, copy=False) # arrays may be shared through a cache
+        filled[tag] = strategy.fill(pd.Series(values, index=filled.index), metadata).astype(values.dtype)
+    return filled
+
+class MemoryBudgetError(ValueError):
+    """Raised when a run's estimated peak memory exceeds the configured budget."""
+
+# Approximate bytes held per reading, measured with tracemalloc (CPython 3.11, pandas 2)
+_RECORD_BYTES_PER_NODE = 300    # per-row dict + boxed timestamp in the JSON-ready records
+_OUTPUT_BYTES_PER_COLUMN = 32   # boxed float + list/dict slot per output value
+_COMPACT_OUTPUT_BYTES_PER_COLUMN = 6  # base64 text of a float32 (16/3 bytes), rounded up
+_RAW_BYTES_PER_SENSOR = 40      # long-format row: timestamp, value, tag/unit/quality refs
+_LOOP_BYTES_PER_NODE = 40       # float64 working arrays of the recycle loop solver
+
+def estimate_peak_memory(ops_graph: OperationsGraph, n_readings: int, compact: bool = False) -> int:
+    """Estimates peak bytes process_dynamic_graph needs for this graph and reading count."""
+    sensors_per_node = [len(node_sensor_specs(node.type, node.params)) for node in ops_graph.nodes]
+    n_nodes, n_sensors = len(sensors_per_node), sum(sensors_per_node)
+    output_columns = n_nodes + n_sensors
+
     G = create_graph(ops_graph)
-    start_time = datetime(2024, 1, 1)
-    timestep_seconds = 5
-    timestep_minutes = timestep_seconds / 60
+    largest_loop = max((len(c) for c in nx.strongly_connected_components(G) if len(c) > 1), default=0)
+    loop = _LOOP_BYTES_PER_NODE * largest_loop
+
+    # Raw sensor data only lives for one node at a time
+    max_sensors = max(sensors_per_node, default=0)
+    if compact:
+        itemsize = np.dtype(np.float32).itemsize
+        one_node = 3 * np.dtype(np.float64).itemsize * max_sensors
+        output = _COMPACT_OUTPUT_BYTES_PER_COLUMN * output_columns
+        per_reading = output + itemsize * (n_sensors + n_nodes) + one_node + loop
+    else:
+        itemsize = np.dtype(np.float64).itemsize
+        per_reading = (
+            _OUTPUT_BYTES_PER_COLUMN * output_columns + _RECORD_BYTES_PER_NODE * n_nodes
+            + _RAW_BYTES_PER_SENSOR * max_sensors + 2 * itemsize * n_sensors + itemsize * n_nodes + loop
+        )
+    return int(per_reading * n_readings)
+
+def _clip_percentages(filled: pd.DataFrame) -> pd.DataFrame:
+    if 'EFFICIENCY' in filled.columns:
+        filled['EFFICIENCY'] = filled['EFFICIENCY'].clip(lower=0, upper=100)
+    if 'CONVERSION_RATE' in filled.columns:
+        filled['CONVERSION_RATE'] = filled['CONVERSION_RATE'].clip(lower=0, upper=100)
+    return filled
+
+def _flow_tonnes(flow: pd.Series, timestep_minutes: float) -> float:
+    # Accumulate in float64 (numpy sums pairwise) so float32 flows don't drift the credit totals.
+    return float(np.nansum(flow.to_numpy(), dtype=np.float64) * timestep_minutes / 1000)
+
+COMPACT_COLUMN_DTYPE = '<f4'
+
+def _encode_column(values: np.ndarray) -> str:
+    # Raw little-endian float32 as base64 (~5.3 bytes per value) rather than a
+    # list of boxed floats; NaN marks unfilled readings.
+    return base64.b64encode(np.ascontiguousarray(values, dtype=COMPACT_COLUMN_DTYPE).tobytes()).decode('ascii')
+
+def _edge_weight(G: nx.DiGraph, source: str, target: str) -> float:
+    raw_weight = G.edges[source, target].get('weight', 1.0)
+    weight = float(raw_weight) if raw_weight is not None else 1.0
+    if not np.isfinite(weight) or weight < 0:
+        weight = 0.0
+    return weight
+
+def edge_split_ratio(G: nx.DiGraph, source: str, target: str) -> float:
+    """
+    Fraction of a node's outflow sent along source -> target.
+    Outgoing edge weights are normalized so mass is conserved across fan-out.
+    """
+    successors = list(G.successors(source))
+    total_weight = sum(_edge_weight(G, source, succ) for succ in successors)
+    if total_weight > 0:
+        return _edge_weight(G, source, target) / total_weight
+    return 1 / len(successors)
+
+_LOOP_SOLVE_CHUNK = 1 << 20  # matrix elements per batched solve, bounds the (t, k, k) stack
+_STEADY_STATE_MAX_GAIN = 1 - 1e-9
+
+def _check_loop_gain(members: List[str], A: np.ndarray, gain: np.ndarray):
+    """
+    Raises ValueError if diag(gain)·A has spectral radius >= 1 at any reading.
+    Leakage is a fixed offset rather than a gain, so it never rescues a loop.
+    """
+    if gain.shape[1] == 0:
+        return
+    # Spectral radius is monotone in the entries of a nonnegative matrix, so the
+    # per-member peak gain bounds every reading; only check each reading if it fails.
+    if np.abs(np.linalg.eigvals(gain.max(axis=1)[:, None] * A)).max() < _STEADY_STATE_MAX_GAIN:
+        return
+
+    k = len(members)
+    chunk = max(_LOOP_SOLVE_CHUNK // (k * k), 1)
+    diverging = 0
+    for start in range(0, gain.shape[1], chunk):
+        B = gain[:, start:start + chunk].T[:, :, None] * A[None]
+        diverging += int((np.abs(np.linalg.eigvals(B)).max(axis=1) >= _STEADY_STATE_MAX_GAIN).sum())
+    if diverging:
+        raise ValueError(
+            f"Recycle loop {members} has no steady state at {diverging} readings (loop gain reaches 1); "
+            "each loop needs flow split off to nodes outside it or a utilization conversion below 100%; "
+            "transport leakage alone does not count"
+        )
+
+def _solve_loop_chunk(A: np.ndarray, gain: np.ndarray, rhs: np.ndarray, clip: np.ndarray) -> np.ndarray:
+    """
+    Solves out = diag(gain)·A·out + rhs for a (k, m) block of readings, with
+    out clipped at 0 on leakage (clip) members.
+    """
+    k, m = rhs.shape
+    M = np.eye(k)[None] - gain.T[:, :, None] * A[None]
+    b = rhs.T
+
+    if not clip.any():
+        return np.linalg.solve(M, b[..., None])[..., 0].T
+
+    # With clipping this is a linear complementarity problem on a Z-matrix, which
+    # Chandrasekaran's method solves exactly: start with every clipped member at 0
+    # and release those whose unclipped value is positive, at most k rounds.
+    eye = np.eye(k)
+    clamped = np.tile(clip, (m, 1))
+    out = np.full((m, k), np.nan)
+    active = np.arange(m)
+    for _ in range(k + 1):
+        Ma, ba, c = M[active], b[active], clamped[active]
+        Ma[c] = eye[np.nonzero(c)[1]]
+        ba = np.where(c, 0.0, ba)
+        x = np.linalg.solve(Ma, ba[..., None])[..., 0]
+
+        unclipped = b[active] + gain.T[active] * (x @ A.T)
+        release = c & (unclipped > 0)
+        done = ~release.any(axis=1)
+        out[active[done]] = x[done]
+        clamped[active] &= ~release
+        active = active[~done]
+        if active.size == 0:
+            break
+    return out.T
+
+def solve_recycle_loop(
+    G: nx.DiGraph,
+    members: List[str],
+    node_flows: Dict[str, pd.Series],
+    filled_data_dict: Dict[str, pd.DataFrame],
+    index: pd.Index,
+):
+    """
+    Solves the mass balance of a strongly connected component (recycle loop).
+
+    Every node in the loop applies the same transformation as in the acyclic
+    pass (leakage for transport, conversion for utilization), capture nodes
+    add their own captured flow on top of recycled inflow, and flows entering
+    from upstream components are treated as fixed inputs. Each timestep is a
+    small linear system (I - diag(gain)·A)·out = rhs, solved directly and
+    batched over the time axis.
+
+    Returns (flows, fresh_capture): output flow per member, and the freshly
+    captured flow of capture members (excluding recycled mass).
+    Raises ValueError when the loop has no steady state, i.e. the spectral
+    radius of diag(gain)·A reaches 1 at some reading (no losses in the loop).
+    """
+    pos = {node_id: i for i, node_id in enumerate(members)}
+    k, n = len(members), len(index)
+
+    # A[i, j] = share of member j's outflow routed to member i
+    A = np.zeros((k, k))
+    external = np.zeros((k, n))
+    gain = np.ones((k, n))
+    offset = np.zeros((k, n))
+    clip = np.zeros(k, dtype=bool)
+    fresh_capture = {}
+
+    for node_id in members:
+        i = pos[node_id]
+        for p in G.predecessors(node_id):
+            ratio = edge_split_ratio(G, p, node_id)
+            if p in pos:
+                A[i, pos[p]] += ratio
+            elif p in node_flows:
+                external[i] += node_flows[p].reindex(index).to_numpy(dtype=float) * ratio
+
+        node_type = G.nodes[node_id]['type']
+        filled_df = filled_data_dict.get(node_id)
+        if filled_df is None or filled_df.empty:
+            continue
+        cols = filled_df.reindex(index)
+        if node_type == 'capture' and 'FLOW' in cols.columns and 'EFFICIENCY' in cols.columns:
+            source = (cols['FLOW'] / 60) * (cols['EFFICIENCY'] / 100) # kg/min
+            offset[i] = source.to_numpy(dtype=float)
+            fresh_capture[node_id] = source
+        elif node_type == 'transport' and 'LEAKAGE' in cols.columns:
+            offset[i] = -(cols['LEAKAGE'] / 60).to_numpy(dtype=float) # kg/min
+            clip[i] = True
+        elif node_type == 'utilization' and 'CONVERSION_RATE' in cols.columns:
+            gain[i] = (cols['CONVERSION_RATE'] / 100).to_numpy(dtype=float)
+
+    # Unfilled readings (NaN) propagate around the whole loop, as in the acyclic pass
+    rhs = gain * external + offset
+    valid = np.flatnonzero(np.isfinite(rhs).all(axis=0) & np.isfinite(gain).all(axis=0))
+    _check_loop_gain(members, A, gain[:, valid])
+
+    out = np.full((k, n), np.nan)
+    chunk = max(_LOOP_SOLVE_CHUNK // (k * k), 1)
+    for start in range(0, len(valid), chunk):
+        t = valid[start:start + chunk]
+        out[:, t] = _solve_loop_chunk(A, gain[:, t], rhs[:, t], clip)
+
+    flows = {node_id: pd.Series(out[pos[node_id]], index=index) for node_id in members}
+    return flows, fresh_capture
+
+SIMULATION_START = datetime(2024, 1, 1)
+TIMESTEP_SECONDS = 5
+
+def _nbytes(value) -> int:
+    """Approximate bytes held by cached arrays and frames, including nested containers."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True).sum())
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    return 0
+
+class NodeWorkCache:
+    """
+    Thread-safe memo of per-node simulation stages (raw draws, gap-filled
+    frames), shared across scenarios in a batch. Concurrent requests for the
+    same key wait on the first computation instead of repeating it.
+
+    Each pending scenario retains the keys it will read and releases them once
+    read, so an entry is only kept while another scenario still needs it.
+    Entries that would take nbytes past capacity_bytes are not kept (they are
+    recomputed if needed again). nbytes tracks the approximate size of
+    everything cached.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures: Dict[Any, Future] = {}
+        self._sizes: Dict[Any, int] = {}
+        self._refs: Dict[Any, int] = {}
+        self.hits = 0
+        self.nbytes = 0
+        self.capacity_bytes: Optional[int] = None
+
+    def retain(self, key):
+        with self._lock:
+            self._refs[key] = self._refs.get(key, 0) + 1
+
+    def release(self, key):
+        with self._lock:
+            refs = self._refs.pop(key, 0) - 1
+            if refs > 0:
+                self._refs[key] = refs
+            else:
+                self._drop(key)
+
+    def set_capacity(self, capacity_bytes: Optional[int]):
+        with self._lock:
+            self.capacity_bytes = capacity_bytes
+
+    def shrink_to(self, nbytes: int):
+        """Evicts finished entries, oldest first, until at most nbytes are cached."""
+        with self._lock:
+            for key in list(self._sizes):
+                if self.nbytes <= nbytes:
+                    break
+                self._drop(key)
+
+    def _drop(self, key):
+        self._futures.pop(key, None)
+        self.nbytes -= self._sizes.pop(key, 0)
+
+    def _keep(self, key, size: int) -> bool:
+        if self._refs.get(key, 0) < 2: # nobody but the computing scenario needs it
+            return False
+        return self.capacity_bytes is None or self.nbytes + size <= self.capacity_bytes
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = self._futures[key] = Future()
+            else:
+                self.hits += 1
+        if owner:
+            try:
+                result = compute()
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                size = _nbytes(result)
+                with self._lock:
+                    if self._futures.get(key) is future:
+                        if self._keep(key, size):
+                            self._sizes[key] = size
+                            self.nbytes += size
+                        else:
+                            # Callers already waiting on the future still get the result
+                            del self._futures[key]
+                future.set_result(result)
+        return future.result()
+
+def node_rng(seed: int, node_id: str) -> np.random.Generator:
+    """Per-node generator: the same seed and node id always give the same sensor draws."""
+    return np.random.default_rng([seed, zlib.crc32(node_id.encode())])
+
+def make_time_index(n_readings: int, compact: bool = False) -> pd.Index:
+    if compact:
+        return pd.RangeIndex(n_readings)
+    return pd.DatetimeIndex([SIMULATION_START + pd.Timedelta(seconds=TIMESTEP_SECONDS*i) for i in range(n_readings)])
+
+def simulate_raw_node(node_type: str, params: Dict[str, Any], n_readings: int, compact: bool = False, rng=None):
+    """
+    Stage 1 for one node: compact sensor arrays (see simulate_node_arrays), or
+    a wide frame with NaN for BAD readings. None if the node has no sensors.
+    The result is never modified by gap filling, so it can be shared.
+    """
+    if compact:
+        return simulate_node_arrays(node_type, params, n_readings, dtype=np.float32, rng=rng) or None
+
+    df = simulate_node_data(node_type, params, n_readings, SIMULATION_START, rng=rng)
+    if df.empty:
+        return None
+
+    # Pivot to wide format to process series individually
+    # Need to handle BAD quality as NA for gap filling
+    df_copy = df.copy()
+    df_copy.loc[df_copy['quality'] == 'BAD', 'value'] = np.nan
     
-    # 1. Simulate Raw Data
-    raw_data_dict = {}
-    for node_id, data in G.nodes(data=True):
-        raw_data_dict[node_id] = simulate_node_data(data['type'], data['params'], n_readings, start_time)
+    return df_copy.pivot_table(index='timestamp', columns='tag', values='value', dropna=False)
+
+def fill_raw_node(raw, metadata: Dict[str, Any], jurisdiction: str, n_readings: int, compact: bool = False):
+    """Stage 2 for one node: gap-fills simulate_raw_node output. Returns (filled wide frame, audit log)."""
+    if raw is None:
+        return None, {}
+    strategy = get_strategy(jurisdiction)
+
+    if compact:
+        filled_wide = fill_node_arrays(raw, strategy, metadata, n_readings)
+        return _clip_percentages(filled_wide), strategy.audit_log()
+
+    filled_wide = pd.DataFrame(index=raw.index)
+    for col in raw.columns:
+        filled_wide[col] = strategy.fill(raw[col].copy(), metadata)
+        
+    return _clip_percentages(filled_wide), strategy.audit_log()
+
+def simulate_filled_node(
+    node_type: str,
+    params: Dict[str, Any],
+    metadata: Dict[str, Any],
+    jurisdiction: str,
+    n_readings: int,
+    compact: bool = False,
+    rng=None,
+):
+    """Simulates one node's sensors and gap-fills them. Returns (filled wide frame, audit log)."""
+    raw = simulate_raw_node(node_type, params, n_readings, compact, rng=rng)
+    return fill_raw_node(raw, metadata, jurisdiction, n_readings, compact)
+
+def _node_metadata(ops_graph: OperationsGraph, node: Node) -> Dict[str, Any]:
+    node_metadata = dict(node.metadata or {})
+    node_metadata.update(ops_graph.metadata or {})
+    return node_metadata
+
+def node_cache_keys(ops_graph: OperationsGraph, n_readings: int, compact: bool, seed: int) -> Dict[str, Tuple[tuple, tuple]]:
+    """
+    NodeWorkCache keys (raw draws, gap-filled frame) of each node of a seeded
+    run. Draws depend only on the seed and the node's own inputs, so they are
+    shared across jurisdictions; gap filling is keyed per jurisdiction too.
+    """
+    keys = {}
+    for node in ops_graph.nodes:
+        node_key = (seed, node.id, node.type, json.dumps(node.params, sort_keys=True, default=str), n_readings, compact)
+        fill_key = node_key + (
+            ops_graph.jurisdiction.lower(), json.dumps(_node_metadata(ops_graph, node), sort_keys=True, default=str)
+        )
+        keys[node.id] = (('draws',) + node_key, ('filled',) + fill_key)
+    return keys
 
-    # 2. Apply Gap Filling Strategy
-    strategy = get_strategy(ops_graph.jurisdiction)
+def simulate_and_fill(
+    ops_graph: OperationsGraph,
+    n_readings: int,
+    compact: bool = False,
+    seed: Optional[int] = None,
+    cache: Optional[NodeWorkCache] = None,
+):
+    """
+    Stages 1 and 2: simulate raw data and apply the jurisdiction's gap filling,
+    node by node. Returns (filled_data_dict, audit_logs).
+
+    Without a seed, draws come from the global numpy RNG. With a seed, each
+    node draws from node_rng(seed, node_id), so its result is fully determined
+    by its inputs and can be shared through cache (see node_cache_keys). Each
+    node's keys are released once read; the caller retains them beforehand.
+    """
     filled_data_dict = {}
     audit_logs = {}
+    pending = node_cache_keys(ops_graph, n_readings, compact, seed) if cache is not None and seed is not None else {}
 
-    for node_id, df in raw_data_dict.items():
-        if df.empty: continue
-        
-        node_metadata = G.nodes[node_id].get('metadata', {})
-        node_metadata.update(ops_graph.metadata or {})
-        
-        # Pivot to wide format to process series individually
-        # Need to handle BAD quality as NA for gap filling
-        df_copy = df.copy()
-        df_copy.loc[df_copy['quality'] == 'BAD', 'value'] = np.nan
-        
-        wide = df_copy.pivot_table(index='timestamp', columns='tag', values='value', dropna=False)
-        
-        filled_wide = pd.DataFrame(index=wide.index)
-        for col in wide.columns:
-            filled_wide[col] = strategy.fill(wide[col].copy(), node_metadata)
-            
-        filled_data_dict[node_id] = filled_wide
-        audit_logs[node_id] = strategy.audit_log()
+    try:
+        for node in ops_graph.nodes:
+            node_metadata = _node_metadata(ops_graph, node)
+
+            if node.id in pending:
+                draw_key, fill_key = pending.pop(node.id)
+
+                def compute(node=node, node_metadata=node_metadata, draw_key=draw_key):
+                    raw = cache.get_or_compute(
+                        draw_key,
+                        lambda: simulate_raw_node(node.type, node.params, n_readings, compact, rng=node_rng(seed, node.id)),
+                    )
+                    return fill_raw_node(raw, node_metadata, ops_graph.jurisdiction, n_readings, compact)
 
-    # 3. Calculate Flows (Simplified Graph Traversal)
-    # We'll assume a linear or tree-like flow for simplicity in this MVP
+                try:
+                    filled, audit = cache.get_or_compute(fill_key, compute)
+                finally:
+                    cache.release(draw_key)
+                    cache.release(fill_key)
+            else:
+                rng = node_rng(seed, node.id) if seed is not None else None
+                filled, audit = simulate_filled_node(
+                    node.type, node.params, node_metadata, ops_graph.jurisdiction, n_readings, compact, rng=rng
+                )
+
+            if filled is None: continue
+            filled_data_dict[node.id] = filled
+            audit_logs[node.id] = audit
+    finally:
+        # Nodes never reached (on error) give up their keys too
+        for keys in pending.values():
+            for key in keys:
+                cache.release(key)
+
+    return filled_data_dict, audit_logs
+
+STORED_OR_UTILIZED_TYPES = ('storage', 'utilization')
+
+def _stored_share(G: nx.DiGraph, node_id: str, members: List[str] = ()) -> float:
+    """
+    Share of a storage/utilization node's outflow that counts as
+    stored/utilized. The same rule applies in and out of recycle loops:
+    mass sent on to another storage or utilization node is counted there
+    instead, and mass recycled within the node's loop (members) is never
+    counted. A node without successors counts all of its outflow.
+    """
+    if G.out_degree(node_id) == 0:
+        return 1.0
+    share = 0.0
+    for succ in G.successors(node_id):
+        if succ in members or G.nodes[succ]['type'] in STORED_OR_UTILIZED_TYPES:
+            continue
+        share += edge_split_ratio(G, node_id, succ)
+    return share
+
+def propagate_flows(G: nx.DiGraph, filled_data_dict: Dict[str, pd.DataFrame], time_index: pd.Index, dtype=np.float64):
+    """
+    Stage 3: calculate each node's output flow from its inputs and local data.
+
+    Every operation is pointwise in time, so several scenarios with the same
+    topology can be propagated at once by concatenating them along time_index.
+    Returns (nodes_order, node_flows, captured_flows, stored_flows) where
+    captured_flows and stored_flows hold the flow each capture, storage or
+    utilization node contributes to the system-level totals.
+    """
     # flow_in = sum(predecessor outputs)
     # flow_out = calc_node_output(flow_in, node_type)
-    
-    results = {}
-    total_captured_co2 = 0
-    total_stored_or_utilized_co2 = 0
-    
-    # Topological sort ensures we process dependencies first if it's a DAG
-    try:
-        nodes_order = list(nx.topological_sort(G))
-    except nx.NetworkXUnfeasible:
-        nodes_order = list(G.nodes()) # Fallback if cycle
+
+    # Walk the condensation DAG so upstream components are always solved first.
+    # Strongly connected components with more than one node (or a self-loop)
+    # are recycle loops and get their mass balance solved jointly.
+    condensed = nx.condensation(G)
+    nodes_order = []
+    recycle_loops = {} # node_id -> members of its recycle loop
+    for component in nx.topological_sort(condensed):
+        members = condensed.nodes[component]['members']
+        members = [n for n in G.nodes() if n in members]
+        nodes_order.extend(members)
+        if len(members) > 1 or G.has_edge(members[0], members[0]):
+            for node_id in members:
+                recycle_loops[node_id] = members
 
     node_flows = {} # Store calculated output flow series for each node
+    captured_flows = {}
+    stored_flows = {}
+    loop_flows = {}
+    fresh_capture = {}
 
     for node_id in nodes_order:
         data = G.nodes[node_id]
         filled_df = filled_data_dict.get(node_id)
-
-        if filled_df is not None and not filled_df.empty:
-            if 'EFFICIENCY' in filled_df.columns:
-                filled_df['EFFICIENCY'] = filled_df['EFFICIENCY'].clip(lower=0, upper=100)
-            if 'CONVERSION_RATE' in filled_df.columns:
-                filled_df['CONVERSION_RATE'] = filled_df['CONVERSION_RATE'].clip(lower=0, upper=100)
         
         # Get inputs from predecessors
         preds = list(G.predecessors(node_id))
         
         # Base flow from inputs
-        if not preds:
+        if node_id in recycle_loops:
+            if node_id not in loop_flows:
+                flows, fresh = solve_recycle_loop(G, recycle_loops[node_id], node_flows, filled_data_dict, time_index)
+                loop_flows.update(flows)
+                fresh_capture.update(fresh)
+            flow = loop_flows[node_id].astype(dtype)
+        elif not preds:
             # Root nodes: typically capture
             if data['type'] == 'capture' and filled_df is not None and not filled_df.empty:
                 # flow = flow * efficiency
                 if 'FLOW' in filled_df.columns and 'EFFICIENCY' in filled_df.columns:
                     flow = (filled_df['FLOW'] / 60) * (filled_df['EFFICIENCY'] / 100) # kg/min
                 else:
-                    timestamps = [start_time + pd.Timedelta(seconds=timestep_seconds*i) for i in range(n_readings)]
-                    flow = pd.Series(0, index=timestamps)
+                    flow = pd.Series(0, index=time_index, dtype=dtype)
             else:
-                timestamps = [start_time + pd.Timedelta(seconds=timestep_seconds*i) for i in range(n_readings)]
-                flow = pd.Series(0, index=timestamps)
+                flow = pd.Series(0, index=time_index, dtype=dtype)
         else:
             # Sum predecessor contributions while conserving mass across fan-out.
             # Each predecessor's outflow is distributed by normalized outgoing edge weights.
@@ -160,38 +627,16 @@ def process_dynamic_graph(ops_graph: OperationsGraph, n_readings: int = 720):
                 if pred_flow is None:
                     continue
 
-                successors = list(G.successors(p))
-                if not successors:
-                    continue
-
-                outgoing_weights = []
-                for succ in successors:
-                    raw_weight = G.edges[p, succ].get('weight', 1.0)
-                    weight = float(raw_weight) if raw_weight is not None else 1.0
-                    if not np.isfinite(weight) or weight < 0:
-                        weight = 0.0
-                    outgoing_weights.append(weight)
-
-                total_weight = sum(outgoing_weights)
-                if total_weight > 0:
-                    this_raw_weight = G.edges[p, node_id].get('weight', 1.0)
-                    this_weight = float(this_raw_weight) if this_raw_weight is not None else 1.0
-                    if not np.isfinite(this_weight) or this_weight < 0:
-                        this_weight = 0.0
-                    split_ratio = this_weight / total_weight
-                else:
-                    split_ratio = 1 / len(successors)
-
+                split_ratio = edge_split_ratio(G, p, node_id)
                 valid_preds.append(pred_flow * split_ratio)
 
             if valid_preds:
                 flow = sum(valid_preds)
             else:
-                timestamps = [start_time + pd.Timedelta(seconds=timestep_seconds*i) for i in range(n_readings)]
-                flow = pd.Series(0, index=timestamps)
+                flow = pd.Series(0, index=time_index, dtype=dtype)
 
-        # Apply node transformation if it has local data
-        if filled_df is not None and not filled_df.empty:
+        # Apply node transformation if it has local data (already applied inside recycle loops)
+        if node_id not in recycle_loops and filled_df is not None and not filled_df.empty:
             if data['type'] == 'transport':
                 # flow_out = flow_in - leakage
                 if 'LEAKAGE' in filled_df.columns:
@@ -205,13 +650,72 @@ def process_dynamic_graph(ops_graph: OperationsGraph, n_readings: int = 720):
         
         # Output is just passed through for storage/other
         node_flows[node_id] = flow
+
+        # Inside a recycle loop only freshly captured CO2 counts, not recycled mass.
+        if data['type'] == 'capture':
+            captured = fresh_capture.get(node_id) if node_id in recycle_loops else flow
+            if captured is not None:
+                captured_flows[node_id] = captured
+        if data['type'] in STORED_OR_UTILIZED_TYPES:
+            stored_flows[node_id] = flow * _stored_share(G, node_id, recycle_loops.get(node_id, ()))
+
+    return nodes_order, node_flows, captured_flows, stored_flows
+
+def summarize_results(
+    ops_graph: OperationsGraph,
+    G: nx.DiGraph,
+    nodes_order: List[str],
+    node_flows: Dict[str, pd.Series],
+    captured_flows: Dict[str, pd.Series],
+    stored_flows: Dict[str, pd.Series],
+    filled_data_dict: Dict[str, pd.DataFrame],
+    audit_logs: Dict[str, Dict[str, Any]],
+    n_readings: int,
+    compact: bool = False,
+) -> Dict[str, Any]:
+    """Stage 4: per-node JSON-ready timeseries and system-level KPIs for one scenario."""
+    timestep_minutes = TIMESTEP_SECONDS / 60
+    results = {}
+    total_captured_co2 = 0
+    total_stored_or_utilized_co2 = 0
+
+    for node_id in nodes_order:
+        data = G.nodes[node_id]
+        filled_df = filled_data_dict.get(node_id)
+        flow = node_flows[node_id]
         
         # Aggregate system-level KPIs by physical component role.
-        if data['type'] == 'capture':
-            total_captured_co2 += (flow.sum() * timestep_minutes) / 1000
-        if data['type'] in ['storage', 'utilization']:
-            total_stored_or_utilized_co2 += (flow.sum() * timestep_minutes) / 1000
+        if node_id in captured_flows:
+            total_captured_co2 += _flow_tonnes(captured_flows[node_id], timestep_minutes)
+        if node_id in stored_flows:
+            total_stored_or_utilized_co2 += _flow_tonnes(stored_flows[node_id], timestep_minutes)
             
+        flow_total_tonnes = _flow_tonnes(flow, timestep_minutes)
+        if not np.isfinite(flow_total_tonnes):
+            flow_total_tonnes = 0.0
+
+        results[node_id] = {
+            'type': data['type'],
+            'name': data.get('name', node_id),
+            'total_flow_tonnes': flow_total_tonnes,
+            'audit': audit_logs.get(node_id, {})
+        }
+
+        if compact:
+            # Columnar output on the implicit time axis: timestamp i = start_time + i * timestep_seconds
+            columns = {'flow_kg_min': _encode_column(flow.to_numpy())}
+            if filled_df is not None:
+                for col in filled_df.columns:
+                    columns[col] = _encode_column(filled_df[col].to_numpy())
+            results[node_id]['timeseries'] = {
+                'start_time': SIMULATION_START.isoformat(),
+                'timestep_seconds': TIMESTEP_SECONDS,
+                'dtype': COMPACT_COLUMN_DTYPE,
+                'encoding': 'base64',
+                'columns': columns,
+            }
+            continue
+
         # Join with filled_df to include raw params like EFFICIENCY and LEAKAGE
         if filled_df is not None and not filled_df.empty:
             flow_df = flow.to_frame(name='flow_kg_min').join(filled_df)
@@ -223,18 +727,7 @@ def process_dynamic_graph(ops_graph: OperationsGraph, n_readings: int = 720):
         flow_df = flow_df.replace([np.inf, -np.inf], np.nan)
         # Convert to object dtype first so None is preserved instead of cast back to NaN.
         flow_df = flow_df.astype(object).where(pd.notnull(flow_df), None)
-
-        flow_total_tonnes = float((flow.sum() * timestep_minutes) / 1000)
-        if not np.isfinite(flow_total_tonnes):
-            flow_total_tonnes = 0.0
-            
-        results[node_id] = {
-            'type': data['type'],
-            'name': data.get('name', node_id),
-            'timeseries': flow_df.to_dict('records'),
-            'total_flow_tonnes': flow_total_tonnes,
-            'audit': audit_logs.get(node_id, {})
-        }
+        results[node_id]['timeseries'] = flow_df.to_dict('records')
 
     total_net_co2 = float(max(0, total_captured_co2 - total_stored_or_utilized_co2))
     if not np.isfinite(total_net_co2):
@@ -245,8 +738,55 @@ def process_dynamic_graph(ops_graph: OperationsGraph, n_readings: int = 720):
         'total_captured_co2_tonnes': float(total_captured_co2),
         'total_stored_or_utilized_co2_tonnes': float(total_stored_or_utilized_co2),
         'total_net_co2_tonnes': total_net_co2,
-        'simulation_timestep_seconds': timestep_seconds,
+        'simulation_timestep_seconds': TIMESTEP_SECONDS,
         'simulation_readings': int(n_readings),
-        'simulation_duration_minutes': float((n_readings * timestep_seconds) / 60),
-        'jurisdiction_used': ops_graph.jurisdiction
+        'simulation_duration_minutes': float((n_readings * TIMESTEP_SECONDS) / 60),
+        'jurisdiction_used': ops_graph.jurisdiction,
+        'compact': compact,
     }
+
+def check_memory_budget(ops_graph: OperationsGraph, n_readings: int, compact: bool, memory_budget_bytes: Optional[int]) -> Optional[int]:
+    """Raises MemoryBudgetError if the run won't fit; returns the estimate (None without a budget)."""
+    if memory_budget_bytes is None:
+        return None
+    estimate = estimate_peak_memory(ops_graph, n_readings, compact=compact)
+    if estimate > memory_budget_bytes:
+        hint = ""
+        if not compact:
+            compact_estimate = estimate_peak_memory(ops_graph, n_readings, compact=True)
+            hint = f"; compact mode needs ~{compact_estimate // 2**20} MB"
+        raise MemoryBudgetError(
+            f"Estimated peak memory {estimate // 2**20} MB exceeds budget of {memory_budget_bytes // 2**20} MB{hint}"
+        )
+    return estimate
+
+def process_dynamic_graph(
+    ops_graph: OperationsGraph,
+    n_readings: int = 720,
+    compact: bool = False,
+    memory_budget_bytes: Optional[int] = None,
+    seed: Optional[int] = None,
+    cache: Optional[NodeWorkCache] = None,
+):
+    """
+    Simulates, gap-fills and propagates flows through an operations graph.
+
+    compact=True stores sensor values and flows as float32 on an implicit
+    start + step time axis, and returns each node's timeseries as base64
+    encoded little-endian float32 columns (NaN for unfilled readings)
+    instead of per-row records. Tonne totals are always accumulated in float64.
+    seed makes sensor draws reproducible per node (see simulate_and_fill).
+    Raises MemoryBudgetError if the estimated peak memory exceeds
+    memory_budget_bytes.
+    """
+    check_memory_budget(ops_graph, n_readings, compact, memory_budget_bytes)
+
+    G = create_graph(ops_graph)
+    dtype = np.float32 if compact else np.float64
+    filled_data_dict, audit_logs = simulate_and_fill(ops_graph, n_readings, compact, seed=seed, cache=cache)
+    nodes_order, node_flows, captured_flows, stored_flows = propagate_flows(
+        G, filled_data_dict, make_time_index(n_readings, compact), dtype
+    )
+    return summarize_results(
+        ops_graph, G, nodes_order, node_flows, captured_flows, stored_flows, filled_data_dict, audit_logs, n_readings, compact
+    )
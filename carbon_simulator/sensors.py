@@ -2,6 +2,37 @@ import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 
+def simulate_sensor_values(
+    n_readings: int,
+    base_value: float,
+    noise_std: float,
+    dropout_rate: float,
+    dtype=np.float64,
+    rng=None
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Draws a single sensor's readings as arrays.
+    Returns (values, valid) where valid is False at injected dropouts.
+    rng may be a np.random.Generator; defaults to the global numpy RNG.
+    """
+    if rng is None:
+        rng = np.random
+    values = base_value + rng.normal(0, noise_std, n_readings)
+    values = np.clip(values, 0, None)  # physical values can't be negative
+
+    # inject dropouts
+    valid = np.ones(n_readings, dtype=bool)
+    dropout_indices = rng.choice(
+        n_readings,
+        size=int(n_readings * dropout_rate),
+        replace=False
+    )
+    values[dropout_indices] = 0.0
+    valid[dropout_indices] = False
+
+    return values.astype(dtype, copy=False), valid
+
+
 def simulate_sensor(
     n_readings: int,
     base_value: float,
@@ -10,7 +41,8 @@ def simulate_sensor(
     tag_name: str,
     unit: str,
     start_time: datetime,
-    interval_seconds: int = 5
+    interval_seconds: int = 5,
+    rng=None
 ) -> pd.DataFrame:
     """
     Simulates a single industrial sensor's time-series output.
@@ -21,19 +53,8 @@ def simulate_sensor(
         for i in range(n_readings)
     ]
 
-    values = base_value + np.random.normal(0, noise_std, n_readings)
-    values = np.clip(values, 0, None)  # physical values can't be negative
-
-    # inject dropouts
-    quality = ['GOOD'] * n_readings
-    dropout_indices = np.random.choice(
-        n_readings,
-        size=int(n_readings * dropout_rate),
-        replace=False
-    )
-    for i in dropout_indices:
-        values[i] = 0.0
-        quality[i] = 'BAD'
+    values, valid = simulate_sensor_values(n_readings, base_value, noise_std, dropout_rate, rng=rng)
+    quality = np.array(['BAD', 'GOOD'], dtype=object)[valid.astype(np.intp)]
 
     return pd.DataFrame({
         'timestamp': timestamps,
@@ -1,17 +1,36 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 from fastapi.middleware.cors import CORSMiddleware
-from graph_engine import OperationsGraph, process_dynamic_graph
+from graph_engine import MemoryBudgetError, OperationsGraph, process_dynamic_graph
+from batch import BatchRequest, run_batch
+from visualize import render_graph_report, shutdown_render_pool, start_render_pool
 import uvicorn
+import base64
+import json
 import os
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Chart rendering workers are started once and reused by every report
+    start_render_pool()
+    yield
+    shutdown_render_pool()
+
 app = FastAPI(
     title="Carbon Operations Map Engine",
     description="Dynamic simulation of carbon value chain with jurisdictional gap filling",
     redirect_slashes=False,
+    lifespan=lifespan,
 )
 
+# Optional per-request memory budget; requests estimated to exceed it are rejected with 413
+MEMORY_BUDGET_MB = os.environ.get("SIMULATION_MEMORY_BUDGET_MB")
+MEMORY_BUDGET_BYTES = int(float(MEMORY_BUDGET_MB) * 2**20) if MEMORY_BUDGET_MB else None
+
 # Add CORS middleware to allow requests from the React frontend
 app.add_middleware(
     CORSMiddleware,
@@ -25,17 +44,57 @@ def read_root():
     return {"status": "ok", "message": "Carbon Operations Engine Running"}
 
 @app.post("/simulate")
-def simulate_graph(ops_graph: OperationsGraph, readings: int = 720):
+def simulate_graph(ops_graph: OperationsGraph, readings: int = 720, compact: bool = False, seed: Optional[int] = None):
     """
     Simulates data generation, gap-filling, and flow calculation
     for a provided operations graph.
+    compact=true returns base64 float32 columnar timeseries for large runs;
+    seed makes the sensor draws reproducible.
     """
     try:
-        result = process_dynamic_graph(ops_graph, n_readings=readings)
+        result = process_dynamic_graph(
+            ops_graph, n_readings=readings, compact=compact, memory_budget_bytes=MEMORY_BUDGET_BYTES, seed=seed
+        )
         return {"status": "success", "data": result}
+    except MemoryBudgetError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/simulate/report")
+def simulate_report(ops_graph: OperationsGraph, readings: int = 720, max_points: int = Query(2000, ge=2), compact: bool = False):
+    """
+    Simulates the graph and returns per-node report charts
+    (flow, cumulative ledger, unfilled gaps) as base64-encoded PNGs.
+    """
+    try:
+        result = process_dynamic_graph(
+            ops_graph, n_readings=readings, compact=compact, memory_budget_bytes=MEMORY_BUDGET_BYTES
+        )
+        images = render_graph_report(result, max_points=max_points)
+        charts = {
+            node_id: "data:image/png;base64," + base64.b64encode(png).decode("ascii")
+            for node_id, png in images.items()
+        }
+        return {"status": "success", "data": {"charts": charts}}
+    except MemoryBudgetError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/simulate/batch")
+def simulate_batch(batch: BatchRequest):
+    """
+    Simulates many scenarios in one request. Identical seeded node work is
+    shared, scenarios with the same topology are propagated together, and
+    one JSON line per scenario is streamed back as each finishes.
+    """
+    def stream():
+        for entry in run_batch(batch, memory_budget_bytes=MEMORY_BUDGET_BYTES):
+            yield json.dumps(jsonable_encoder(entry)) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 if __name__ == "__main__":
     uvicorn.run(
         "server:app",
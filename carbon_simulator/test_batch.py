@@ -0,0 +1,95 @@
+import pydantic
+import pytest
+
+from batch import BatchRequest, run_batch
+from graph_engine import estimate_peak_memory, process_dynamic_graph
+
+GRAPH = {'nodes': [{'id': 'c', 'type': 'capture', 'name': 'Capture', 'params': {}}], 'edges': []}
+
+
+def recycle_graph(conversion_rate, jurisdiction='epa', recycle_weight=0.3):
+    return {
+        'nodes': [
+            {'id': 'c', 'type': 'capture', 'name': 'Capture', 'params': {}},
+            {'id': 'u', 'type': 'utilization', 'name': 'Utilization', 'params': {'conversion_rate': conversion_rate}},
+            {'id': 's', 'type': 'storage', 'name': 'Storage', 'params': {}},
+        ],
+        'edges': [
+            {'source': 'c', 'target': 'u'},
+            {'source': 'u', 'target': 'c', 'weight': recycle_weight},
+            {'source': 'u', 'target': 's', 'weight': 1 - recycle_weight},
+        ],
+        'jurisdiction': jurisdiction,
+    }
+
+
+def entries_by_id(batch, **kwargs):
+    entries = list(run_batch(batch, **kwargs))
+    by_id = {entry['id']: entry for entry in entries}
+    assert len(by_id) == len(entries) == len(batch.scenarios)
+    return by_id
+
+
+def test_explicit_id_may_not_collide_with_positional_default():
+    BatchRequest(scenarios=[{'graph': GRAPH}, {'graph': GRAPH, 'id': 'x'}])
+
+    with pytest.raises(pydantic.ValidationError, match="duplicate scenario id '1'"):
+        BatchRequest(scenarios=[{'graph': GRAPH, 'id': '1'}, {'graph': GRAPH}])
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_stacked_results_equal_individual_runs(compact):
+    batch = BatchRequest(
+        scenarios=[
+            {'graph': recycle_graph(rate, jurisdiction), 'readings': readings, 'compact': compact, 'seed': seed}
+            for rate, jurisdiction, readings, seed in [
+                (95, 'epa', 300, 1), (90, 'lcfs', 500, 1), (95, 'puro', 300, 2), (85, 'alberta', 400, 3),
+            ]
+        ] + [{'graph': GRAPH, 'readings': 300, 'compact': compact}], # its own topology, batch seed
+        seed=7,
+    )
+
+    by_id = entries_by_id(batch)
+
+    for i, scenario in enumerate(batch.scenarios):
+        entry = by_id[str(i)]
+        assert entry['status'] == 'success'
+        expected = process_dynamic_graph(
+            scenario.graph, n_readings=scenario.readings, compact=compact, seed=scenario.seed or batch.seed
+        )
+        assert entry['data'] == expected
+
+
+def test_failing_stacked_group_falls_back_to_per_scenario_entries():
+    # Same topology; only the second scenario's loop is lossless and has no steady state
+    batch = BatchRequest(
+        scenarios=[
+            {'id': 'lossy', 'graph': recycle_graph(90, recycle_weight=1.0)},
+            {'id': 'lossless', 'graph': recycle_graph(100, recycle_weight=1.0)},
+        ],
+        seed=1,
+    )
+
+    by_id = entries_by_id(batch)
+
+    assert by_id['lossy']['status'] == 'success'
+    assert by_id['lossy']['data'] == process_dynamic_graph(batch.scenarios[0].graph, seed=1)
+    assert by_id['lossless']['status'] == 'error'
+    assert 'no steady state' in by_id['lossless']['detail']
+
+
+def test_over_budget_scenario_yields_error_entry():
+    batch = BatchRequest(
+        scenarios=[
+            {'id': 'small', 'graph': recycle_graph(90), 'readings': 100},
+            {'id': 'large', 'graph': recycle_graph(90), 'readings': 100_000},
+        ],
+        seed=1,
+    )
+    budget = 2 * estimate_peak_memory(batch.scenarios[0].graph, 100)
+
+    by_id = entries_by_id(batch, memory_budget_bytes=budget)
+
+    assert by_id['small']['status'] == 'success'
+    assert by_id['large']['status'] == 'error'
+    assert 'exceeds budget' in by_id['large']['detail']
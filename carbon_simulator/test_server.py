@@ -0,0 +1,25 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from server import app
+
+client = TestClient(app)
+
+GRAPH = {'nodes': [{'id': 'c', 'type': 'capture', 'name': 'Capture', 'params': {}}], 'edges': []}
+
+
+@pytest.mark.parametrize('max_points', [0, 1, -5])
+def test_report_rejects_too_few_points(max_points):
+    response = client.post(f'/simulate/report?max_points={max_points}', json=GRAPH)
+
+    assert response.status_code == 422
+
+
+def test_simulate_over_memory_budget_returns_413(monkeypatch):
+    monkeypatch.setattr(server, 'MEMORY_BUDGET_BYTES', 1)
+
+    response = client.post('/simulate?readings=1000', json=GRAPH)
+
+    assert response.status_code == 413
+    assert 'exceeds budget' in response.json()['detail']
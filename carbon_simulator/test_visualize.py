@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+import visualize
+from graph_engine import Edge, Node, OperationsGraph, process_dynamic_graph
+
+
+def chain_result(n_readings, compact=False, jurisdiction='alberta'):
+    graph = OperationsGraph(
+        nodes=[
+            Node(id='c', type='capture', name='Capture', params={}),
+            Node(id='s', type='storage', name='Storage', params={}),
+        ],
+        edges=[Edge(source='c', target='s')],
+        jurisdiction=jurisdiction, # leaves gaps unfilled
+    )
+    return process_dynamic_graph(graph, n_readings=n_readings, compact=compact, seed=1)
+
+
+def payload(result, node_id='c', max_points=2000):
+    return visualize._prepare_node(node_id, result['nodes'][node_id], result['simulation_timestep_seconds'], max_points)
+
+
+def test_reused_figure_takes_limits_from_current_chart_only():
+    short = payload(chain_result(100))
+    assert short['gaps'].any()
+    visualize.render_node_chart(short)
+    axes = visualize._report_figure()['axes']
+    expected = [ax.get_xlim() for ax in axes]
+
+    visualize.render_node_chart(payload(chain_result(20000, compact=True)))
+    visualize.render_node_chart(short)
+
+    for ax, limits in zip(axes, expected):
+        assert ax.get_xlim() == pytest.approx(limits)
+
+
+def test_decimate_keeps_spikes_and_bounds_points():
+    values = np.zeros(10_000)
+    values[1234], values[8765] = 50.0, -50.0
+    values[5000] = np.nan
+
+    keep = visualize.decimate(values, 200)
+
+    assert len(keep) <= 200
+    assert np.all(np.diff(keep) > 0)
+    assert 1234 in keep and 8765 in keep
+
+
+def test_decimate_returns_everything_when_short():
+    assert visualize.decimate(np.arange(5.0), 10).tolist() == [0, 1, 2, 3, 4]
+
+
+def test_bucket_gaps_marks_bucket_with_any_gap():
+    times = np.arange(10.0)
+    gaps = np.zeros(10, dtype=bool)
+    gaps[7] = True
+
+    bucket_times, bucketed = visualize._bucket_gaps(times, gaps, 4)
+
+    assert bucket_times.tolist() == [0.0, 3.0, 6.0, 9.0]
+    assert bucketed.tolist() == [False, False, True, False]
+
+
+def test_report_filenames_are_unique_after_sanitizing():
+    names = visualize._report_filenames(['a b', 'a_b', 'a/b', 'ok'])
+
+    assert names['a b'] == 'a_b.png'
+    assert names['ok'] == 'ok.png'
+    assert len(set(names.values())) == 4
+    assert all(name.startswith('a_b-') for name in (names['a_b'], names['a/b']))
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_prepare_node_reads_records_and_compact_results(compact):
+    result = chain_result(3000, compact=compact)
+
+    prepared = payload(result, max_points=500)
+
+    assert len(prepared['times']) <= 500 and len(prepared['gaps']) <= 500
+    end = 2999 * 5 / 60 # minutes since the first reading
+    assert prepared['gap_times'][0] == 0.0
+    assert 0 <= prepared['times'].min() and prepared['times'].max() <= end
+    assert prepared['cum_times'][-1] == pytest.approx(end)
+    assert prepared['xlabel'] == 'Minutes since 2024-01-01 00:00'
+    assert 0 < prepared['completeness'] < 100
+    # The ledger ends at the node's total, however the series was encoded
+    assert prepared['cumulative'][-1] == pytest.approx(result['nodes']['c']['total_flow_tonnes'], rel=1e-5)
+
+
+def test_prepare_node_with_empty_timeseries():
+    prepared = visualize._prepare_node('x', {'timeseries': []}, 5, 100)
+
+    assert len(prepared['times']) == 0
+    assert prepared['completeness'] == 100.0
+    assert prepared['xlabel'] == 'Minutes'
@@ -1,6 +1,19 @@
+import base64
+import hashlib
+import io
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional
+
 import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
+import numpy as np
 import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 
 def plot_value_chain(timeseries: pd.DataFrame, results: dict):
     fig = plt.figure(figsize=(14, 9))
@@ -60,4 +73,261 @@ def plot_value_chain(timeseries: pd.DataFrame, results: dict):
 
     plt.savefig('carbon_value_chain.png', dpi=150, bbox_inches='tight')
     plt.show()
-    print("Chart saved to carbon_value_chain.png")
\ No newline at end of file
+    print("Chart saved to carbon_value_chain.png")
+
+
+# ── Headless per-node reports for dynamic graph results ─────────────────────
+# Figures are built with the object-oriented API on an Agg canvas, so no
+# display or pyplot state is needed and rendering is safe in worker processes.
+
+def decimate(values: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Min/max decimation: returns sorted indices that keep the lowest and
+    highest reading of each bucket, so spikes survive downsampling.
+    """
+    n = len(values)
+    if n <= max_points:
+        return np.arange(n)
+
+    bucket = int(np.ceil(n / max(max_points // 2, 1)))
+    n_buckets = int(np.ceil(n / bucket))
+    padded = np.full(n_buckets * bucket, np.nan)
+    padded[:n] = values
+    padded = padded.reshape(n_buckets, bucket)
+
+    offsets = np.arange(n_buckets) * bucket
+    lows = np.argmin(np.where(np.isnan(padded), np.inf, padded), axis=1) + offsets
+    highs = np.argmax(np.where(np.isnan(padded), -np.inf, padded), axis=1) + offsets
+    return np.unique(np.minimum(np.concatenate([lows, highs]), n - 1))
+
+
+def _bucket_gaps(times: np.ndarray, gaps: np.ndarray, max_points: int):
+    """Reduces a per-reading gap mask to at most max_points buckets (a bucket is a gap if any reading is)."""
+    n = len(gaps)
+    if n <= max_points:
+        return times, gaps
+
+    bucket = int(np.ceil(n / max_points))
+    n_buckets = int(np.ceil(n / bucket))
+    padded = np.zeros(n_buckets * bucket, dtype=bool)
+    padded[:n] = gaps
+    bucketed = padded.reshape(n_buckets, bucket).any(axis=1)
+    return times[::bucket], bucketed
+
+
+def _prepare_node(node_id: str, node: dict, timestep_seconds: float, max_points: int) -> dict:
+    """Extracts and decimates one node's series so only small arrays reach the workers."""
+    if isinstance(node['timeseries'], dict):
+        # Compact results: columns on an implicit start + step time axis
+        columnar = node['timeseries']
+        ts = pd.DataFrame({
+            name: np.frombuffer(base64.b64decode(column), dtype=columnar['dtype']).astype(float)
+            for name, column in columnar['columns'].items()
+        })
+        ts['timestamp'] = pd.Timestamp(columnar['start_time']) + pd.to_timedelta(
+            np.arange(len(ts)) * columnar['timestep_seconds'], unit='s'
+        )
+    else:
+        ts = pd.DataFrame.from_records(node['timeseries'])
+    # Plotted as minutes since the first reading: a plain numeric axis is much
+    # cheaper to tick and label than a date axis.
+    start = None
+    if ts.empty:
+        times = np.array([], dtype=float)
+        flow = np.array([], dtype=float)
+        gaps = np.array([], dtype=bool)
+    else:
+        stamps = pd.to_datetime(ts['timestamp'])
+        start = stamps.iloc[0]
+        times = ((stamps - start) / pd.Timedelta(minutes=1)).to_numpy(dtype=float)
+        flow = pd.to_numeric(ts['flow_kg_min'], errors='coerce').to_numpy(dtype=float)
+        # A gap is any reading the jurisdiction's strategy left unfilled.
+        gaps = ts.isna().any(axis=1).to_numpy()
+
+    cumulative = np.cumsum(np.nan_to_num(flow)) * (timestep_seconds / 60) / 1000
+    keep = decimate(flow, max_points)
+    gap_times, gap_mask = _bucket_gaps(times, gaps, max_points)
+    # The ledger is monotonic, so a plain stride (plus the final total) is enough.
+    cum_keep = np.arange(0, len(cumulative), max(len(cumulative) // max_points, 1))
+    if len(cumulative):
+        cum_keep = np.append(cum_keep, len(cumulative) - 1)
+
+    return {
+        'node_id': node_id,
+        'title': f"{node.get('name', node_id)} ({node.get('type', 'node')})",
+        'xlabel': f"Minutes since {start:%Y-%m-%d %H:%M}" if start is not None else 'Minutes',
+        'times': times[keep],
+        'flow': flow[keep],
+        'cum_times': times[cum_keep],
+        'cumulative': cumulative[cum_keep],
+        'gap_times': gap_times,
+        'gaps': gap_mask,
+        'completeness': float(100 * (1 - gaps.mean())) if len(gaps) else 100.0,
+    }
+
+
+def _shade_gaps(ax, payload: dict, alpha: float):
+    # One collection for all gaps; a span per gap is far too slow on patchy data.
+    gaps = payload['gaps']
+    if not gaps.any():
+        return None
+    # Each gap covers its reading up to the next one, so isolated gaps keep a width.
+    where = gaps | np.concatenate([[False], gaps[:-1]])
+    return ax.fill_between(payload['gap_times'], 0, 1, where=where, step='post',
+                           transform=ax.get_xaxis_transform(), color='tomato', alpha=alpha, linewidth=0)
+
+
+# Figure construction costs about as much as drawing, so each worker process
+# (or server thread, for in-process renders) builds the report figure once and
+# only swaps the data between nodes.
+_report_figures = threading.local()
+
+def _report_figure() -> dict:
+    chart = getattr(_report_figures, 'chart', None)
+    if chart is not None:
+        return chart
+
+    fig = Figure(figsize=(10, 6))
+    FigureCanvasAgg(fig)
+    title = fig.suptitle('', fontsize=12, fontweight='bold')
+    # Fixed margins instead of bbox_inches='tight', which draws every figure twice.
+    gs = gridspec.GridSpec(3, 1, figure=fig, hspace=0.6, height_ratios=[3, 3, 1],
+                           left=0.08, right=0.97, top=0.9, bottom=0.1)
+
+    # ── Flow ─────────────────────────────────────────────────────────────────
+    ax1 = fig.add_subplot(gs[0])
+    flow_line, = ax1.plot([], [], color='steelblue', linewidth=1.0)
+    ax1.set_ylabel('kg / min')
+    ax1.set_title('Flow')
+    ax1.grid(alpha=0.3)
+
+    # ── Cumulative ledger ─────────────────────────────────────────────────────
+    ax2 = fig.add_subplot(gs[1], sharex=ax1)
+    cumulative_line, = ax2.plot([], [], color='seagreen', linewidth=1.5)
+    ax2.set_ylabel('CO₂ (tonnes)')
+    ax2.set_title('Cumulative Ledger')
+    ax2.grid(alpha=0.3)
+
+    # ── Gap highlights ────────────────────────────────────────────────────────
+    ax3 = fig.add_subplot(gs[2], sharex=ax1)
+    ax3.set_yticks([])
+    # The axes share x, so date labels are only drawn once, under the gap strip
+    for ax in (ax1, ax2):
+        ax.tick_params(labelbottom=False)
+
+    chart = _report_figures.chart = {
+        'fig': fig, 'title': title, 'axes': (ax1, ax2, ax3),
+        'flow': flow_line, 'cumulative': cumulative_line, 'gaps': [],
+    }
+    return chart
+
+
+def render_node_chart(payload: dict, dpi: int = 80) -> bytes:
+    """Renders flow, cumulative ledger and gap highlights for one node to PNG bytes."""
+    chart = _report_figure()
+    ax1, ax2, ax3 = chart['axes']
+
+    chart['title'].set_text(payload['title'])
+    chart['flow'].set_data(payload['times'], payload['flow'])
+    chart['cumulative'].set_data(payload['cum_times'], payload['cumulative'])
+    for collection in chart['gaps']:
+        collection.remove()
+    chart['gaps'] = [c for c in (_shade_gaps(ax1, payload, alpha=0.2), _shade_gaps(ax3, payload, alpha=1.0)) if c is not None]
+    ax3.set_title(f"Unfilled gaps — completeness {payload['completeness']:.1f}%")
+    ax3.set_xlabel(payload['xlabel'])
+    # relim ignores collections, so the lines alone set the limits and earlier
+    # (longer) gap strips don't leak into this chart through the shared x-axis
+    for ax in (ax1, ax2, ax3):
+        ax.relim()
+        ax.autoscale_view()
+
+    buffer = io.BytesIO()
+    # Fast zlib level: default compression costs more than drawing the chart
+    chart['fig'].savefig(buffer, format='png', dpi=dpi, pil_kwargs={'compress_level': 1})
+    return buffer.getvalue()
+
+
+_render_pool = None
+_render_workers = 1
+_render_pool_lock = threading.Lock()
+
+def start_render_pool(workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """
+    Starts (once) the long-lived pool shared by all reports. Workers are
+    spawned rather than forked, since the server renders from a
+    multithreaded process. workers only applies when the pool is created.
+    """
+    global _render_pool, _render_workers
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_workers = workers or os.cpu_count() or 1
+            _render_pool = ProcessPoolExecutor(max_workers=_render_workers,
+                                               mp_context=multiprocessing.get_context('spawn'))
+        return _render_pool
+
+
+def shutdown_render_pool():
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is not None:
+            _render_pool.shutdown(cancel_futures=True)
+            _render_pool = None
+
+
+def _report_filenames(node_ids) -> Dict[str, str]:
+    """Filesystem-safe, unique PNG names; ids that sanitize alike get a short hash."""
+    names, used = {}, set()
+    for node_id in node_ids:
+        base = re.sub(r'[^A-Za-z0-9_.-]', '_', node_id)
+        name = base
+        if name in used:
+            name = f"{base}-{hashlib.sha1(node_id.encode()).hexdigest()[:8]}"
+        suffix = 2
+        while name in used:
+            name = f"{base}-{suffix}"
+            suffix += 1
+        used.add(name)
+        names[node_id] = name + '.png'
+    return names
+
+
+def render_graph_report(
+    result: dict,
+    output_dir: Optional[str] = None,
+    max_points: int = 2000,
+    workers: Optional[int] = None,
+    dpi: int = 80,
+) -> Dict[str, Any]:
+    """
+    Renders one chart per node of a process_dynamic_graph result.
+
+    Series are decimated to about max_points before plotting and figures are
+    rendered on a shared pool of worker processes (workers=1 renders
+    in-process). Returns node_id -> PNG path when output_dir is given,
+    otherwise node_id -> PNG bytes.
+    """
+    timestep_seconds = result.get('simulation_timestep_seconds', 5)
+    payloads = [
+        _prepare_node(node_id, node, timestep_seconds, max_points)
+        for node_id, node in result['nodes'].items()
+    ]
+
+    if workers == 1 or len(payloads) <= 1:
+        images = [render_node_chart(p, dpi) for p in payloads]
+    else:
+        pool = start_render_pool(workers)
+        chunksize = max(len(payloads) // (4 * _render_workers), 1)
+        images = list(pool.map(render_node_chart, payloads, [dpi] * len(payloads), chunksize=chunksize))
+
+    if output_dir is None:
+        return {p['node_id']: png for p, png in zip(payloads, images)}
+
+    os.makedirs(output_dir, exist_ok=True)
+    filenames = _report_filenames(p['node_id'] for p in payloads)
+    paths = {}
+    for p, png in zip(payloads, images):
+        path = os.path.join(output_dir, filenames[p['node_id']])
+        with open(path, 'wb') as f:
+            f.write(png)
+        paths[p['node_id']] = path
+    return paths